@@ -0,0 +1,156 @@
+"""
+Shared async OpenAI client for the simulation, procedure and quiz AI paths.
+
+Every LLM call goes through one AsyncOpenAI client on one pooled
+httpx.AsyncClient, so TLS connections are kept alive and reused (over HTTP/2
+when the optional h2 package is installed) instead of being set up per
+request.  Calls are awaited on the event loop - a slow completion no longer
+pins a threadpool worker.
+
+A semaphore bounds how many completions are in flight at once; the timeout
+passed to chat() covers waiting for a slot as well as the request itself, so
+callers can fall back to their non-AI answer on time.
+
+The httpx / OpenAI clients are created on first use inside the running event
+loop (and again if used from a different loop, e.g. under a test client) and
+closed by aclose() at shutdown.
+"""
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+try:
+    from openai import AsyncOpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    AsyncOpenAI = None
+    OPENAI_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+PLACEHOLDER_API_KEY = "sk-your-actual-openai-api-key-here"
+
+
+class AIUnavailableError(RuntimeError):
+    """OpenAI isn't installed or no API key is configured"""
+
+
+class SharedOpenAIClient:
+    def __init__(self, api_key: Optional[str], max_concurrency: int = 16,
+                 default_timeout_seconds: float = 30.0, max_connections: int = 32,
+                 keepalive_expiry_seconds: float = 60.0, max_retries: int = 1):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.default_timeout_seconds = default_timeout_seconds
+        self.max_connections = max_connections
+        self.keepalive_expiry_seconds = keepalive_expiry_seconds
+        self.max_retries = max_retries
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self._in_flight = 0
+        self._stats = {"calls": 0, "errors": 0, "timeouts": 0, "total_seconds": 0.0}
+
+    @property
+    def available(self) -> bool:
+        return OPENAI_AVAILABLE and bool(self.api_key) and self.api_key != PLACEHOLDER_API_KEY
+
+    def __bool__(self) -> bool:
+        return self.available
+
+    @property
+    def client(self):
+        """The AsyncOpenAI client (created on first use)"""
+        if not self.available:
+            raise AIUnavailableError("OpenAI is not configured")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        # Pooled connections belong to the loop that opened them
+        if self._client is None or (loop is not None and loop is not self._loop):
+            self._loop = loop
+            self._http_client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry_seconds
+                ),
+                timeout=httpx.Timeout(self.default_timeout_seconds, connect=5.0)
+            )
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=self._http_client,
+                max_retries=self.max_retries,
+                timeout=self.default_timeout_seconds
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def _create(self, client, kwargs, timeout):
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                return await client.chat.completions.create(timeout=timeout, **kwargs)
+            finally:
+                self._in_flight -= 1
+
+    async def chat(self, timeout: Optional[float] = None, **kwargs):
+        """
+        chat.completions.create(**kwargs), raising asyncio.TimeoutError if no
+        response arrives within `timeout` seconds (queueing included).
+        """
+        client = self.client
+        timeout = timeout or self.default_timeout_seconds
+        started = time.monotonic()
+        self._stats["calls"] += 1
+        try:
+            return await asyncio.wait_for(self._create(client, kwargs, timeout), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._stats["total_seconds"] += time.monotonic() - started
+
+    async def validate(self) -> bool:
+        """List models once to check the API key"""
+        if not self.available:
+            return False
+        try:
+            models = await self.client.models.list(timeout=10.0)
+            print(f"✅ OpenAI API key validated, {len(models.data)} models available")
+            return True
+        except Exception as e:
+            print(f"❌ OpenAI API key validation failed: {e}")
+            return False
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+        self._http_client = None
+        self._semaphore = None
+
+    def stats(self) -> dict:
+        calls = self._stats["calls"]
+        return {
+            "configured": self.available,
+            "http2": HTTP2_AVAILABLE,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "calls": calls,
+            "errors": self._stats["errors"],
+            "timeouts": self._stats["timeouts"],
+            "avg_seconds": round(self._stats["total_seconds"] / calls, 3) if calls else 0.0,
+        }
@@ -0,0 +1,269 @@
+"""
+Warm pool of pre-generated AI quiz questions.
+
+The AI-hybrid quiz used to generate its AI question while the user waited.
+Instead, validated questions are generated ahead of time, per
+(discipline, topic), and a quiz just takes what it needs from the pool.
+
+- take() pops the oldest questions for a key (up to the count asked for) and
+  records that the key is in demand.  A key whose depth falls below
+  `low_watermark` gets an asynchronous refill up to `capacity`.
+- A producer loop periodically tops up every key that was asked for within
+  `demand_days`, so keys that only run dry overnight are warm again in the
+  morning.
+- Refills ask for up to `batch_size` questions per LLM call; each question
+  of a batch is validated on its own.
+- Generation stops for the day once `daily_token_budget` tokens have been
+  spent on it (0 = no budget).  The budget is shared by all workers.
+
+The pool lives in a small SQLite file, so it survives restarts and every
+worker on the host takes from (and refills) the same pool - a question is
+handed out exactly once.  Each statement is a single indexed read or write,
+run in a worker thread: a write lock held by another process (up to the
+5 second busy timeout) never stalls the event loop.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# generate(discipline, topic, context, count) -> (up to count questions, tokens spent)
+Generator = Callable[[str, str, Optional[str], int], Awaitable[Tuple[List[dict], int]]]
+
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+def validate_ai_question(question: Optional[dict]) -> bool:
+    """A parsed AI question is usable as a quiz question"""
+    if not question or not str(question.get("text") or "").strip():
+        return False
+    options = question.get("options") or []
+    if len(options) != 4 or any(not str(option).strip() for option in options):
+        return False
+    if len({str(option).strip().lower() for option in options}) != 4:
+        return False
+    correct_idx = question.get("correct_idx")
+    return isinstance(correct_idx, int) and 0 <= correct_idx < 4
+
+
+class AIQuestionWarmPool:
+    def __init__(self, path: str, generate: Generator, capacity: int = 10, low_watermark: int = 3,
+                 batch_size: int = 5, daily_token_budget: int = 200000, refill_concurrency: int = 2,
+                 max_age_days: float = 30, demand_days: float = 7, enabled: bool = True):
+        self.path = path
+        self.generate = generate
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.batch_size = max(1, batch_size)
+        self.daily_token_budget = daily_token_budget
+        self.refill_concurrency = refill_concurrency
+        self.max_age_days = max_age_days
+        self.demand_days = demand_days
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._refilling = set()
+        self._tasks = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stats = {"hits": 0, "misses": 0, "generated": 0, "rejected": 0, "failed": 0,
+                       "budget_exhausted": 0}
+
+    # ---- store ----
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS ai_question_pool (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    discipline TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_ai_question_pool_key ON ai_question_pool (discipline, topic, id);
+                CREATE TABLE IF NOT EXISTS ai_question_pool_demand (
+                    discipline TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    context TEXT,
+                    last_requested_at REAL NOT NULL,
+                    PRIMARY KEY (discipline, topic)
+                );
+                CREATE TABLE IF NOT EXISTS ai_question_pool_usage (
+                    day TEXT PRIMARY KEY,
+                    tokens INTEGER NOT NULL DEFAULT 0,
+                    questions INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            conn = self._db()
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+
+    async def _aexecute(self, sql: str, params: tuple = ()):
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    def _insert(self, discipline: str, topic: str, questions: List[dict]):
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.executemany(
+                "INSERT INTO ai_question_pool (discipline, topic, payload, created_at) VALUES (?, ?, ?, ?)",
+                [(discipline, topic, json.dumps(question), now) for question in questions]
+            )
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def depth(self, discipline: str, topic: str) -> int:
+        return self._execute("SELECT COUNT(*) FROM ai_question_pool WHERE discipline = ? AND topic = ?",
+                             (discipline, topic))[0][0]
+
+    def tokens_spent_today(self) -> int:
+        rows = self._execute("SELECT tokens FROM ai_question_pool_usage WHERE day = ?", (date.today().isoformat(),))
+        return rows[0][0] if rows else 0
+
+    def _budget_left(self) -> bool:
+        return self.daily_token_budget <= 0 or self.tokens_spent_today() < self.daily_token_budget
+
+    # ---- consumer ----
+
+    async def take(self, discipline: str, topic: str, context: Optional[str] = None, count: int = 1) -> List[dict]:
+        """Pop up to `count` pooled questions for (discipline, topic); schedules a refill when the pool runs low"""
+        if not self.enabled:
+            return []
+        questions, depth = await asyncio.to_thread(self._take, discipline, topic, context, count)
+        self._stats["hits"] += len(questions)
+        self._stats["misses"] += count - len(questions)
+        if depth < self.low_watermark:
+            self.schedule_refill(discipline, topic, context)
+        return questions
+
+    def _take(self, discipline: str, topic: str, context: Optional[str], count: int) -> Tuple[List[dict], int]:
+        """Record demand and pop the questions; returns them with the depth left"""
+        self._execute(
+            "INSERT INTO ai_question_pool_demand (discipline, topic, context, last_requested_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (discipline, topic) DO UPDATE SET last_requested_at = excluded.last_requested_at, "
+            "context = COALESCE(excluded.context, ai_question_pool_demand.context)",
+            (discipline, topic, context, time.time())
+        )
+        rows = self._execute(
+            "DELETE FROM ai_question_pool WHERE id IN ("
+            "SELECT id FROM ai_question_pool WHERE discipline = ? AND topic = ? ORDER BY id LIMIT ?"
+            ") RETURNING payload",
+            (discipline, topic, count)
+        )
+        return [json.loads(payload) for (payload,) in rows], self.depth(discipline, topic)
+
+    # ---- producer ----
+
+    def schedule_refill(self, discipline: str, topic: str, context: Optional[str] = None):
+        """Refill (discipline, topic) in the background; no-op if one is already running"""
+        key = (discipline, topic)
+        if key in self._refilling:
+            return
+        self._refilling.add(key)
+        task = asyncio.ensure_future(self._refill(discipline, topic, context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self, discipline: str, topic: str, context: Optional[str]) -> int:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.refill_concurrency)
+        added = 0
+        failures = 0
+        try:
+            async with self._semaphore:
+                while failures < MAX_CONSECUTIVE_FAILURES:
+                    missing = self.capacity - await asyncio.to_thread(self.depth, discipline, topic)
+                    if missing <= 0:
+                        break
+                    if not await asyncio.to_thread(self._budget_left):
+                        self._stats["budget_exhausted"] += 1
+                        print(f"⚠️ AI question pool: daily token budget ({self.daily_token_budget}) spent")
+                        break
+                    try:
+                        questions, tokens = await self.generate(discipline, topic, context, min(self.batch_size, missing))
+                    except Exception as e:
+                        print(f"⚠️ AI question pool generation failed: {e}")
+                        questions, tokens = [], 0
+                    valid = [question for question in questions or [] if validate_ai_question(question)]
+                    self._stats["rejected"] += len(questions or []) - len(valid)
+                    await self._aexecute(
+                        "INSERT INTO ai_question_pool_usage (day, tokens, questions) VALUES (?, ?, ?) "
+                        "ON CONFLICT (day) DO UPDATE SET tokens = tokens + excluded.tokens, "
+                        "questions = questions + excluded.questions",
+                        (date.today().isoformat(), tokens or 0, len(valid))
+                    )
+                    if not valid:
+                        failures += 1
+                        self._stats["failed"] += 1
+                        continue
+                    failures = 0
+                    await asyncio.to_thread(self._insert, discipline, topic, valid)
+                    added += len(valid)
+                    self._stats["generated"] += len(valid)
+        finally:
+            self._refilling.discard((discipline, topic))
+        if added:
+            print(f"🧠 AI question pool: +{added} for {discipline}/{topic}")
+        return added
+
+    async def top_up(self) -> int:
+        """Expire old questions and refill every key in demand; returns questions added"""
+        if not self.enabled:
+            return 0
+        await self._aexecute("DELETE FROM ai_question_pool WHERE created_at < ?",
+                             (time.time() - self.max_age_days * 86400,))
+        keys = await self._aexecute(
+            "SELECT discipline, topic, context FROM ai_question_pool_demand WHERE last_requested_at >= ?",
+            (time.time() - self.demand_days * 86400,)
+        )
+        added = 0
+        for discipline, topic, context in keys:
+            depth = await asyncio.to_thread(self.depth, discipline, topic)
+            # Checked after the await - take() may have started a refill meanwhile
+            if (discipline, topic) in self._refilling or depth >= self.low_watermark:
+                continue
+            self._refilling.add((discipline, topic))
+            added += await self._refill(discipline, topic, context)
+        return added
+
+    async def run(self, interval_seconds: float):
+        """Producer loop; cancel the task to stop it"""
+        while True:
+            try:
+                await self.top_up()
+            except Exception as e:
+                print(f"⚠️ AI question pool top-up failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> dict:
+        depths: Dict[str, int] = {}
+        if self.enabled:
+            for discipline, topic, count in self._execute(
+                "SELECT discipline, topic, COUNT(*) FROM ai_question_pool GROUP BY discipline, topic"
+            ):
+                depths[f"{discipline}/{topic}"] = count
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "low_watermark": self.low_watermark,
+            "depths": depths,
+            "refilling": len(self._refilling),
+            "tokens_today": self.tokens_spent_today() if self.enabled else 0,
+            "daily_token_budget": self.daily_token_budget,
+            **self._stats,
+        }
@@ -0,0 +1,225 @@
+"""
+Variant cache for AI-generated simulations and procedure exams.
+
+Most generate requests repeat a handful of parameter combinations (same
+specialty, role, scenario...), so the generated content is cached under a
+hash of the normalized parameters.  Each key keeps a pool of up to
+`variants_per_key` different generations which are served round-robin, so
+users repeating a scenario don't keep getting the same case.
+
+- A miss waits for one generation (concurrent misses share it).
+- A hit returns at once; if the pool isn't full yet, or the variant served
+  is older than `ttl_seconds`, one more variant is generated in the
+  background.  Expired variants are dropped when that new one is stored.
+- At most `max_keys` keys are kept; the least recently used key is evicted.
+
+Pools are persisted to a small SQLite file so they survive restarts (only
+generations write to it, hits stay in memory; after a restart keys are
+ranked by their newest variant).  Only genuine AI output is cached - the
+endpoints' fallback content never is.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+Generator = Callable[[], Awaitable[Optional[dict]]]
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_cache_key(kind: str, params: Dict[str, Any]) -> str:
+    """sha256 of the kind + case/whitespace-normalized parameters"""
+    canonical = json.dumps({"kind": kind, "params": _normalize(params)}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Pool:
+    __slots__ = ("variants", "next_index")
+
+    def __init__(self):
+        # [(variant_id, created_at, payload)], oldest first
+        self.variants: List[tuple] = []
+        self.next_index = 0
+
+
+class AIResponseCache:
+    def __init__(self, path: Optional[str], variants_per_key: int = 3, ttl_seconds: float = 7 * 86400,
+                 max_keys: int = 1000, enabled: bool = True):
+        self.path = path
+        self.variants_per_key = max(1, variants_per_key)
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.enabled = enabled
+        self._pools: "OrderedDict[str, _Pool]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats = {"hits": 0, "misses": 0, "refills": 0, "failed_generations": 0, "rejected": 0,
+                       "evictions": 0}
+
+    # ---- persistence ----
+
+    def load(self):
+        """Open the store and read the pools persisted by earlier runs"""
+        if not self.enabled or not self.path or self._conn is not None:
+            return
+        with self._db_lock:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ai_response_variants (
+                    cache_key TEXT NOT NULL,
+                    variant_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (cache_key, variant_id)
+                )
+            """)
+            self._conn.execute("DELETE FROM ai_response_variants WHERE created_at < ?",
+                               (time.time() - self.ttl_seconds,))
+            rows = self._conn.execute(
+                "SELECT cache_key, variant_id, created_at, payload FROM ai_response_variants "
+                "ORDER BY created_at"
+            ).fetchall()
+            self._conn.commit()
+        for cache_key, variant_id, created_at, payload in rows:
+            pool = self._pools.get(cache_key)
+            if pool is None:
+                pool = self._pools[cache_key] = _Pool()
+            self._pools.move_to_end(cache_key)
+            pool.variants.append((variant_id, created_at, json.loads(payload)))
+        for pool in self._pools.values():
+            del pool.variants[:-self.variants_per_key]
+        self._evict()
+        print(f"💾 AI response cache: {len(self._pools)} keys loaded from {self.path}")
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _persist(self, sql: str, params: tuple):
+        if self._conn is None:
+            return
+        try:
+            with self._db_lock:
+                self._conn.execute(sql, params)
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ AI response cache write failed: {e}")
+
+    # ---- pools ----
+
+    def _evict(self):
+        while len(self._pools) > self.max_keys:
+            cache_key, _ = self._pools.popitem(last=False)
+            self._stats["evictions"] += 1
+            self._persist("DELETE FROM ai_response_variants WHERE cache_key = ?", (cache_key,))
+
+    def _store(self, cache_key: str, kind: str, payload: dict):
+        pool = self._pools.get(cache_key)
+        if pool is None:
+            pool = self._pools[cache_key] = _Pool()
+        self._pools.move_to_end(cache_key)
+        now = time.time()
+        variant_id = uuid.uuid4().hex
+        pool.variants.append((variant_id, now, payload))
+        dropped = [variant[0] for variant in pool.variants if now - variant[1] > self.ttl_seconds]
+        dropped += [variant[0] for variant in pool.variants[:-self.variants_per_key] if variant[0] not in dropped]
+        pool.variants = [variant for variant in pool.variants if variant[0] not in dropped]
+        for old_id in dropped:
+            self._persist("DELETE FROM ai_response_variants WHERE cache_key = ? AND variant_id = ?",
+                          (cache_key, old_id))
+        self._persist(
+            "INSERT INTO ai_response_variants (cache_key, variant_id, kind, created_at, payload) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (cache_key, variant_id, kind, now, json.dumps(payload))
+        )
+        self._evict()
+
+    def _generate(self, cache_key: str, kind: str, generate: Generator,
+                  accept: Callable[[dict], bool]) -> asyncio.Future:
+        """One generation per key at a time; the result is only stored if accept() likes it"""
+        future = self._inflight.get(cache_key)
+        if future is not None:
+            return future
+
+        async def run():
+            try:
+                payload = await generate()
+            except Exception as e:
+                print(f"⚠️ AI response generation failed: {e}")
+                payload = None
+            if payload is None:
+                self._stats["failed_generations"] += 1
+            elif accept(payload):
+                self._store(cache_key, kind, payload)
+            else:
+                self._stats["rejected"] += 1
+            return payload
+
+        future = asyncio.ensure_future(run())
+        self._inflight[cache_key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return future
+
+    def _refill(self, cache_key: str, kind: str, generate: Generator, accept: Callable[[dict], bool]):
+        if cache_key in self._inflight:
+            return
+        self._stats["refills"] += 1
+        task = self._generate(cache_key, kind, generate, accept)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def get_or_generate(self, kind: str, params: Dict[str, Any], generate: Generator,
+                              accept: Callable[[dict], bool] = bool) -> Optional[dict]:
+        """
+        A cached variant for (kind, params), or the result of generate() on a
+        miss (returned even if accept() rejects it for caching).  None when
+        nothing is cached and generation failed.
+        The payload is shared - copy it before adding per-request fields.
+        """
+        if not self.enabled:
+            return await generate()
+
+        cache_key = make_cache_key(kind, params)
+        pool = self._pools.get(cache_key)
+        if pool is not None and pool.variants:
+            self._stats["hits"] += 1
+            self._pools.move_to_end(cache_key)
+            _, created_at, payload = pool.variants[pool.next_index % len(pool.variants)]
+            pool.next_index += 1
+            expired = time.time() - created_at > self.ttl_seconds
+            if expired or len(pool.variants) < self.variants_per_key:
+                self._refill(cache_key, kind, generate, accept)
+            return payload
+
+        self._stats["misses"] += 1
+        # shield: a client disconnecting doesn't waste a generation others are waiting on
+        return await asyncio.shield(self._generate(cache_key, kind, generate, accept))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "keys": len(self._pools),
+            "variants": sum(len(pool.variants) for pool in self._pools.values()),
+            "variants_per_key": self.variants_per_key,
+            "generating": len(self._inflight),
+            **self._stats,
+        }
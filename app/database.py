@@ -1,19 +1,128 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from app.models import Base
 import sqlite3
 
 # Use DATABASE_URL from environment (PostgreSQL on Render, SQLite locally)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./theclamed.db")
 
-# Create engine - NO conditions, NO check_same_thread
-engine = create_engine(DATABASE_URL)
+# Pool settings - every engine in the process comes from make_engine() so the
+# whole app shares one pool per database instead of one per module.
+# DB_POOL_SIZE + DB_MAX_OVERFLOW is the most connections one worker process
+# opens to DATABASE_URL, split between the sync and the async engine (the
+# async share comes out of the totals, it doesn't add to them).  The server
+# sees up to workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW); keep that below its
+# max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# (pool_size=0 means "no limit" to SQLAlchemy, so each pool keeps at least one)
+DB_ASYNC_POOL_SIZE = max(1, min(DB_POOL_SIZE - 1, int(os.getenv("DB_ASYNC_POOL_SIZE", str(DB_POOL_SIZE // 2)))))
+DB_ASYNC_MAX_OVERFLOW = min(DB_MAX_OVERFLOW, int(os.getenv("DB_ASYNC_MAX_OVERFLOW", str(DB_MAX_OVERFLOW // 2))))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds; below typical server idle timeouts
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run while a writer commits; NORMAL sync is safe under WAL"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def _pool_options(url: str, is_async: bool = False, **overrides) -> dict:
+    """Shared pool settings; the sizing ones only for engines that get a QueuePool"""
+    options = {
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    poolclass = overrides.get("poolclass")
+    if poolclass is None:
+        # The dialect's default, e.g. SingletonThreadPool / StaticPool for SQLite :memory:
+        parsed = make_url(url)
+        poolclass = parsed.get_dialect(_is_async=is_async).get_pool_class(parsed)
+    sizing = {
+        "pool_size": overrides.pop("pool_size", DB_POOL_SIZE),
+        "max_overflow": overrides.pop("max_overflow", DB_MAX_OVERFLOW),
+        "pool_timeout": overrides.pop("pool_timeout", DB_POOL_TIMEOUT),
+    }
+    if issubclass(poolclass, QueuePool):
+        options.update(sizing)
+    options.update(overrides)
+    return options
+
+
+def make_engine(url: str, **overrides):
+    """Create an engine with the shared pool settings (and SQLite pragmas for SQLite URLs)"""
+    is_sqlite = url.startswith("sqlite")
+    if is_sqlite:
+        # Sessions are handed between FastAPI's threadpool workers
+        overrides.setdefault("connect_args", {"check_same_thread": False})
+
+    new_engine = create_engine(url, **_pool_options(url, **overrides))
+    if is_sqlite and ":memory:" not in url:
+        event.listen(new_engine, "connect", _set_sqlite_pragmas)
+    return new_engine
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its async driver (asyncpg / aiosqlite)"""
+    if url.startswith("postgres://"):
+        # Heroku/Render style scheme
+        url = "postgresql://" + url[len("postgres://"):]
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+        # asyncpg takes "ssl", not libpq's "sslmode"
+        if "sslmode" in parsed.query:
+            query = dict(parsed.query)
+            query["ssl"] = query.pop("sslmode")
+            parsed = parsed.set(query=query)
+    elif backend == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+
+def make_async_engine(url: str, **overrides):
+    """Async counterpart of make_engine() - same pool settings and SQLite pragmas"""
+    async_url = to_async_url(url)
+    new_engine = create_async_engine(async_url, **_pool_options(async_url, is_async=True, **overrides))
+    if async_url.startswith("sqlite") and ":memory:" not in async_url:
+        event.listen(new_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return new_engine
+
+
+def pool_metrics(target_engine) -> dict:
+    """Snapshot of a pool's usage for the admin metrics endpoint"""
+    pool = target_engine.pool
+    metrics = {"pool_class": type(pool).__name__, "status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            metrics[name] = getattr(pool, name)()
+    if hasattr(pool, "_max_overflow"):
+        metrics["max_overflow"] = pool._max_overflow
+    return metrics
+
+
+engine = make_engine(DATABASE_URL, pool_size=max(1, DB_POOL_SIZE - DB_ASYNC_POOL_SIZE),
+                     max_overflow=DB_MAX_OVERFLOW - DB_ASYNC_MAX_OVERFLOW)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the read-heavy endpoints that run on the event loop
+async_engine = make_async_engine(DATABASE_URL, pool_size=DB_ASYNC_POOL_SIZE, max_overflow=DB_ASYNC_MAX_OVERFLOW)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
 # Keamed database (stays SQLite)
 KEAMED_DATABASE_URL = "sqlite:///./keamed.db"
-keamed_engine = create_engine(KEAMED_DATABASE_URL, connect_args={"check_same_thread": False})
+keamed_engine = make_engine(KEAMED_DATABASE_URL)
 KeamedSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=keamed_engine)
 
 def init_db():
@@ -40,9 +149,12 @@ def init_keamed_db():
             question_text TEXT,
             options TEXT,
             correct_answer TEXT,
+            topic TEXT,
             FOREIGN KEY (exam_id) REFERENCES keamed_exams(id)
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_keamed_questions_exam_id ON keamed_questions (exam_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_keamed_exams_discipline_id ON keamed_exams (discipline_id)")
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS keamed_results (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -76,4 +188,8 @@ def get_keamed_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
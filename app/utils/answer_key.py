@@ -0,0 +1,120 @@
+"""
+Cached answer keys for KEAMED exam scoring.
+
+A KEAMED mock exam finishes at the same time for a whole cohort, so the same
+exam is scored many times within seconds.  Each exam's answer key (question
+id -> correct answer and topic, plus the exam fields a result row needs) is
+loaded once and scoring is then a dict lookup per answer.
+
+Loads are single-flight: when a burst of submissions misses together, one
+request reads the database and the rest wait for its result.  Keys carry the
+exam's version at load time, so a key read before an upload / delete
+invalidated the exam is never stored.
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from app.utils.cache import TTLCache
+
+UNKNOWN_TOPIC = "general"
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    exam_id: str
+    title: Optional[str]
+    exam_type: Optional[str]
+    # question id -> (correct answer, topic)
+    answers: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+    topic_totals: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, exam_id: str, title: Optional[str], exam_type: Optional[str],
+              questions: Iterable[Tuple[object, object, Optional[str]]]) -> "AnswerKey":
+        """questions: (question_id, correct_answer, topic) rows"""
+        answers = {}
+        topic_totals: Dict[str, int] = {}
+        for question_id, correct_answer, topic in questions:
+            topic = topic or UNKNOWN_TOPIC
+            answers[str(question_id)] = (str(correct_answer), topic)
+            topic_totals[topic] = topic_totals.get(topic, 0) + 1
+        return cls(exam_id=exam_id, title=title, exam_type=exam_type,
+                   answers=answers, topic_totals=topic_totals)
+
+    @property
+    def total_questions(self) -> int:
+        return len(self.answers)
+
+    def score(self, user_answers: Iterable[dict]) -> Tuple[int, Dict[str, dict]]:
+        """(correct count, per-topic performance) for [{"question_id", "selected_option"}, ...]"""
+        correct_by_topic = {topic: 0 for topic in self.topic_totals}
+        seen = set()
+        for answer in user_answers:
+            question_id = str(answer.get("question_id"))
+            entry = self.answers.get(question_id)
+            # An answer resent for the same question only counts once
+            if entry is None or question_id in seen:
+                continue
+            seen.add(question_id)
+            correct_answer, topic = entry
+            selected = answer.get("selected_option")
+            if selected is not None and str(selected) == correct_answer:
+                correct_by_topic[topic] += 1
+
+        performance = {
+            topic: {
+                "correct": correct_by_topic[topic],
+                "total": total,
+                "percentage": round(correct_by_topic[topic] / total * 100, 1) if total else 0,
+            }
+            for topic, total in self.topic_totals.items()
+        }
+        return sum(correct_by_topic.values()), performance
+
+
+class AnswerKeyCache:
+    """exam_id -> AnswerKey with single-flight loading and explicit invalidation"""
+
+    def __init__(self, max_entries: int = 256, max_age_seconds: float = 600.0):
+        self._keys = TTLCache(max_entries=max_entries, max_age_seconds=max_age_seconds)
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._versions: Dict[str, int] = {}
+        self._global_version = 0
+
+    def _version(self, exam_id: str) -> Tuple[int, int]:
+        with self._lock:
+            return (self._global_version, self._versions.get(exam_id, 0))
+
+    def get(self, exam_id: str, load: Callable[[], Optional[AnswerKey]]) -> Optional[AnswerKey]:
+        """Cached key, or load() it (once per burst of concurrent misses); None if the exam doesn't exist"""
+        key = self._keys.get(exam_id)
+        if key is not None:
+            return key
+        with self._lock:
+            exam_lock = self._loading.setdefault(exam_id, threading.Lock())
+        with exam_lock:
+            key = self._keys.get(exam_id)
+            if key is not None:
+                return key
+            version = self._version(exam_id)
+            key = load()
+            if key is not None and self._version(exam_id) == version:
+                self._keys.set(exam_id, key)
+            return key
+
+    def invalidate(self, exam_id: Optional[str] = None):
+        """Call after an exam's questions change (or with no id after bulk changes)"""
+        with self._lock:
+            if exam_id is None:
+                self._global_version += 1
+            else:
+                self._versions[exam_id] = self._versions.get(exam_id, 0) + 1
+        if exam_id is None:
+            self._keys.clear()
+        else:
+            self._keys.pop(exam_id)
+
+    def stats(self) -> dict:
+        return self._keys.stats()
@@ -0,0 +1,314 @@
+"""
+Retention for the append-only audit tables.
+
+rate_limit_decisions gets a row per limit check and user_activity a row per
+login / submission, so both grow without bound and every admin page that
+scans them slows down week by week.  This module:
+
+  * rolls rate_limit_decisions up into rate_decision_rollups - one row per
+    (day, user, resource, reason) with decision counts - so history survives
+    the raw rows being expired,
+  * expires raw rows older than a configurable TTL, in small chunks so no
+    delete holds long locks (exam_completed activity is never expired; it is
+    the exam-results history),
+  * on PostgreSQL, can convert rate_limit_decisions into a table partitioned
+    by month on decision_time; expired months are then dropped whole instead
+    of deleted row by row.
+
+run_maintenance() does a full pass (roll up finished days, keep partitions
+ahead of time, expire).  It is run from the audit_retention.py CLI (cron) or
+periodically by the app when AUDIT_RETENTION_INTERVAL_HOURS is set.
+"""
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import (Column, Date, Integer, MetaData, String, Table, and_, case, column,
+                        delete, func, insert, select, table, text)
+from sqlalchemy.engine import Connection, Engine
+
+RATE_DECISION_RETENTION_DAYS = int(os.getenv("RATE_DECISION_RETENTION_DAYS", "90"))
+USER_ACTIVITY_RETENTION_DAYS = int(os.getenv("USER_ACTIVITY_RETENTION_DAYS", "365"))
+# Activity types that are data rather than audit trail
+RETAINED_ACTIVITY_TYPES = ("exam_completed",)
+PURGE_CHUNK_SIZE = int(os.getenv("AUDIT_PURGE_CHUNK_SIZE", "5000"))
+PARTITION_MONTHS_AHEAD = 3
+
+metadata = MetaData()
+
+rollup_table = Table(
+    "rate_decision_rollups", metadata,
+    Column("day", Date, primary_key=True),
+    Column("user_id", Integer, primary_key=True),
+    Column("resource_type", String, primary_key=True),
+    Column("reason", String, primary_key=True),
+    Column("decisions", Integer, nullable=False, default=0),
+    Column("allowed_decisions", Integer, nullable=False, default=0),
+)
+
+decisions_table = table(
+    "rate_limit_decisions",
+    column("id"), column("user_id"), column("decision_time"),
+    column("resource_type"), column("allowed"), column("reason"),
+)
+
+activity_table = table(
+    "user_activity",
+    column("id"), column("activity_type"), column("timestamp"),
+)
+
+
+def ensure_rollup_table(engine: Engine):
+    metadata.create_all(engine, tables=[rollup_table])
+
+
+def day_range(start: date, end: date) -> Tuple[datetime, datetime]:
+    """[start 00:00, day after end 00:00) - a range the decision_time index can serve"""
+    return datetime.combine(start, time.min), datetime.combine(end + timedelta(days=1), time.min)
+
+
+def aggregate_rate_decisions(conn: Connection, start: date, end: date,
+                             user_id: Optional[int] = None, resource_type: Optional[str] = None) -> List[dict]:
+    """Rollup-shaped rows computed from raw decisions for the days start..end"""
+    low, high = day_range(start, end)
+    day = func.date(decisions_table.c.decision_time)
+    query = select(
+        day.label("day"),
+        func.coalesce(decisions_table.c.user_id, 0).label("user_id"),
+        func.coalesce(decisions_table.c.resource_type, "").label("resource_type"),
+        func.coalesce(decisions_table.c.reason, "").label("reason"),
+        func.count().label("decisions"),
+        func.sum(case((decisions_table.c.allowed, 1), else_=0)).label("allowed_decisions"),
+    ).where(
+        decisions_table.c.decision_time >= low,
+        decisions_table.c.decision_time < high,
+    )
+    if user_id is not None:
+        query = query.where(decisions_table.c.user_id == user_id)
+    if resource_type is not None:
+        query = query.where(decisions_table.c.resource_type == resource_type)
+    query = query.group_by(day, func.coalesce(decisions_table.c.user_id, 0),
+                           func.coalesce(decisions_table.c.resource_type, ""),
+                           func.coalesce(decisions_table.c.reason, ""))
+    rows = []
+    for row in conn.execute(query).mappings():
+        row = dict(row)
+        # SQLite's date() returns text
+        if isinstance(row["day"], str):
+            row["day"] = date.fromisoformat(row["day"])
+        rows.append(row)
+    return rows
+
+
+def rollup_rate_decisions(conn: Connection, start: date, end: date) -> int:
+    """
+    (Re)compute rollups for start..end from the raw rows.  Only days that
+    still have raw rows are replaced, so re-running over expired history
+    leaves its rollups alone.
+    """
+    rows = aggregate_rate_decisions(conn, start, end)
+    if not rows:
+        return 0
+    days = sorted({row["day"] for row in rows})
+    conn.execute(delete(rollup_table).where(rollup_table.c.day.in_(days)))
+    conn.execute(insert(rollup_table), rows)
+    return len(rows)
+
+
+def read_rollups(conn: Connection, start: date, end: date,
+                 user_id: Optional[int] = None, resource_type: Optional[str] = None) -> List[dict]:
+    query = select(rollup_table).where(rollup_table.c.day >= start, rollup_table.c.day <= end)
+    if user_id is not None:
+        query = query.where(rollup_table.c.user_id == user_id)
+    if resource_type is not None:
+        query = query.where(rollup_table.c.resource_type == resource_type)
+    return [dict(row) for row in conn.execute(query.order_by(rollup_table.c.day)).mappings()]
+
+
+def _chunked_delete(engine: Engine, target, id_column, condition, chunk_size: int) -> int:
+    """Delete matching rows chunk_size at a time, one short transaction per chunk"""
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            ids = select(id_column).where(condition).limit(chunk_size).scalar_subquery()
+            count = conn.execute(delete(target).where(id_column.in_(ids))).rowcount
+        deleted += count
+        if count < chunk_size:
+            return deleted
+
+
+# ========== POSTGRES PARTITIONING ==========
+
+def is_partitioned(conn: Connection, table_name: str = "rate_limit_decisions") -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": table_name}
+    ).scalar()
+    return relkind == "p"
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _partition_name(month: date) -> str:
+    return f"rate_limit_decisions_p{month:%Y%m}"
+
+
+def ensure_partitions(conn: Connection, first_month: date, last_month: date) -> int:
+    """Create the monthly partitions first_month..last_month that don't exist yet"""
+    created = 0
+    month = _month_start(first_month)
+    while month <= last_month:
+        name = _partition_name(month)
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF rate_limit_decisions "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+            ))
+            created += 1
+        month = _next_month(month)
+    return created
+
+
+def partition_rate_decisions(engine: Engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> bool:
+    """
+    One-off migration: rebuild rate_limit_decisions as a table partitioned by
+    month on decision_time, copying the existing rows.  Runs in a single
+    transaction; returns False if the table is already partitioned.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            raise RuntimeError("Partitioning is only supported on PostgreSQL")
+        if is_partitioned(conn):
+            return False
+
+        conn.execute(text("ALTER TABLE rate_limit_decisions RENAME TO rate_limit_decisions_unpartitioned"))
+        sequence = conn.execute(
+            text("SELECT pg_get_serial_sequence('rate_limit_decisions_unpartitioned', 'id')")
+        ).scalar()
+        conn.execute(text(
+            "CREATE TABLE rate_limit_decisions "
+            "(LIKE rate_limit_decisions_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (decision_time)"
+        ))
+        # The partition key has to be part of the primary key and can't be NULL
+        conn.execute(text("ALTER TABLE rate_limit_decisions ALTER COLUMN decision_time SET NOT NULL"))
+        conn.execute(text("ALTER TABLE rate_limit_decisions ADD PRIMARY KEY (id, decision_time)"))
+
+        oldest = conn.execute(text("SELECT min(decision_time) FROM rate_limit_decisions_unpartitioned")).scalar()
+        today = date.today()
+        last_month = today
+        for _ in range(months_ahead):
+            last_month = _next_month(last_month)
+        ensure_partitions(conn, oldest.date() if oldest else today, last_month)
+        # Catches rows beyond the pre-created months until maintenance adds their partition
+        conn.execute(text("CREATE TABLE rate_limit_decisions_default PARTITION OF rate_limit_decisions DEFAULT"))
+
+        conn.execute(text(
+            "INSERT INTO rate_limit_decisions "
+            "(id, user_id, decision_time, resource_type, allowed, reason, current_count, limit_value) "
+            "SELECT id, user_id, COALESCE(decision_time, now()), resource_type, allowed, reason, "
+            "current_count, limit_value FROM rate_limit_decisions_unpartitioned"
+        ))
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY rate_limit_decisions.id"))
+        conn.execute(text("DROP TABLE rate_limit_decisions_unpartitioned"))
+
+        conn.execute(text("CREATE INDEX ix_rate_limit_decisions_user_id ON rate_limit_decisions (user_id)"))
+        conn.execute(text("CREATE INDEX ix_rate_limit_decisions_decision_time ON rate_limit_decisions (decision_time)"))
+        conn.execute(text("CREATE INDEX ix_rate_limit_decisions_resource_type ON rate_limit_decisions (resource_type)"))
+        conn.execute(text(
+            "ALTER TABLE rate_limit_decisions ADD FOREIGN KEY (user_id) REFERENCES users (id)"
+        ))
+    return True
+
+
+def drop_expired_partitions(conn: Connection, before: date) -> List[str]:
+    """Drop monthly partitions that end on or before `before`"""
+    names = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'rate_limit_decisions'"
+    )).scalars().all()
+    dropped = []
+    for name in names:
+        suffix = name.rsplit("_p", 1)[-1]
+        if not (name.startswith("rate_limit_decisions_p") and suffix.isdigit() and len(suffix) == 6):
+            continue
+        month = date(int(suffix[:4]), int(suffix[4:]), 1)
+        if _next_month(month) <= before:
+            conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+# ========== EXPIRY ==========
+
+def purge_rate_decisions(engine: Engine, before: date, chunk_size: int = PURGE_CHUNK_SIZE) -> Dict[str, object]:
+    """Expire raw decisions older than `before`, rolling their days up first"""
+    with engine.begin() as conn:
+        oldest = conn.execute(select(func.min(decisions_table.c.decision_time))).scalar()
+        if oldest is None:
+            return {"rolled_up": 0, "dropped_partitions": [], "deleted": 0}
+        if isinstance(oldest, str):
+            oldest = datetime.fromisoformat(oldest)
+        rolled_up = rollup_rate_decisions(conn, oldest.date(), before - timedelta(days=1)) \
+            if oldest.date() < before else 0
+        partitioned = is_partitioned(conn)
+        dropped = drop_expired_partitions(conn, before) if partitioned else []
+
+    cutoff = datetime.combine(before, time.min)
+    deleted = _chunked_delete(engine, decisions_table, decisions_table.c.id,
+                              decisions_table.c.decision_time < cutoff, chunk_size)
+    return {"rolled_up": rolled_up, "dropped_partitions": dropped, "deleted": deleted}
+
+
+def purge_user_activity(engine: Engine, before: date, chunk_size: int = PURGE_CHUNK_SIZE) -> int:
+    """Expire audit-only activity rows older than `before` (exam results are kept)"""
+    cutoff = datetime.combine(before, time.min)
+    condition = and_(
+        activity_table.c.timestamp < cutoff,
+        activity_table.c.activity_type.notin_(RETAINED_ACTIVITY_TYPES),
+    )
+    return _chunked_delete(engine, activity_table, activity_table.c.id, condition, chunk_size)
+
+
+def run_maintenance(engine: Engine, today: Optional[date] = None,
+                    decision_days: int = RATE_DECISION_RETENTION_DAYS,
+                    activity_days: int = USER_ACTIVITY_RETENTION_DAYS) -> Dict[str, object]:
+    """Roll up finished days, keep partitions ahead, expire old rows.  A TTL of 0 keeps rows forever."""
+    today = today or date.today()
+    ensure_rollup_table(engine)
+    report: Dict[str, object] = {}
+
+    with engine.begin() as conn:
+        # Re-roll the newest rolled-up day too: write-behind flushes can land just after midnight
+        newest = conn.execute(select(func.max(rollup_table.c.day))).scalar()
+        if isinstance(newest, str):
+            newest = date.fromisoformat(newest)
+        if newest is None:
+            oldest = conn.execute(select(func.min(decisions_table.c.decision_time))).scalar()
+            if isinstance(oldest, str):
+                oldest = datetime.fromisoformat(oldest)
+            newest = oldest.date() if oldest else today
+        yesterday = today - timedelta(days=1)
+        report["rolled_up"] = rollup_rate_decisions(conn, newest, yesterday) if newest <= yesterday else 0
+
+        if is_partitioned(conn):
+            last_month = today
+            for _ in range(PARTITION_MONTHS_AHEAD):
+                last_month = _next_month(last_month)
+            report["partitions_created"] = ensure_partitions(conn, today, last_month)
+
+    if decision_days > 0:
+        report["rate_decisions"] = purge_rate_decisions(engine, today - timedelta(days=decision_days))
+    if activity_days > 0:
+        report["user_activity_deleted"] = purge_user_activity(engine, today - timedelta(days=activity_days))
+    return report
@@ -0,0 +1,139 @@
+"""
+Background, batched writer for append-only audit rows.
+
+Request handlers used to add + commit (+ refresh) one user_activity or
+rate_limit_decisions row inline, so every login or exam submission paid for
+an extra transaction.  Handlers now only enqueue the row; a worker thread
+drains the queue and writes whatever has accumulated with one executemany
+insert per table, every flush_interval_ms or as soon as batch_size rows are
+waiting.
+
+The queue is bounded.  When it is full, best-effort rows (logins, decisions)
+are dropped and counted, while durable rows (exam submissions) make the
+request wait for room instead - backpressure rather than data loss.  A batch
+that fails to insert is retried a few times before it is counted as failed.
+stop() drains the queue, so a clean shutdown writes everything enqueued.
+"""
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine
+
+_STOP = object()
+
+
+class BatchedAuditWriter:
+    """Bounded queue of (table, row) pairs bulk-inserted by a worker thread"""
+
+    def __init__(self, engine: Engine, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval_ms: int = 200, max_retries: int = 3, put_timeout_seconds: float = 5.0):
+        self._engine = engine
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._max_retries = max_retries
+        self._put_timeout = put_timeout_seconds
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def enqueue(self, table: Table, row: dict, durable: bool = False) -> bool:
+        """
+        Queue one row for insertion into table.  Returns False if it was dropped.
+        durable rows wait (up to put_timeout_seconds, then insert inline) instead of being dropped.
+        """
+        if self._thread is None:
+            # Not started (scripts, tests) or already stopped: write through
+            self._write({table: [row]})
+            return True
+        try:
+            if durable:
+                self._queue.put((table, row), timeout=self._put_timeout)
+            else:
+                self._queue.put_nowait((table, row))
+        except queue.Full:
+            if durable:
+                self._write({table: [row]})
+                return True
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _write(self, batch: Dict[Table, List[dict]]):
+        rows = sum(len(table_rows) for table_rows in batch.values())
+        for attempt in range(self._max_retries + 1):
+            try:
+                with self._engine.begin() as conn:
+                    for table, table_rows in batch.items():
+                        conn.execute(table.insert(), table_rows)
+                with self._lock:
+                    self.written += rows
+                    self.batches += 1
+                return
+            except Exception as e:
+                if attempt == self._max_retries:
+                    with self._lock:
+                        self.failed += rows
+                    print(f"❌ Audit batch of {rows} rows could not be written: {e}")
+                    return
+                time.sleep(min(2 ** attempt * 0.1, 2.0))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: Dict[Table, List[dict]] = {}
+            count = 0
+            deadline = time.monotonic() + self._flush_interval
+            while count < self._batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(timeout, 0)) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    # Drain what was enqueued before stop()
+                    continue
+                table, row = item
+                batch.setdefault(table, []).append(row)
+                count += 1
+            if batch:
+                self._write(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Write everything still queued, then stop the worker"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "batch_size": self._batch_size,
+                "flush_interval_ms": int(self._flush_interval * 1000),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
@@ -0,0 +1,67 @@
+"""
+Small thread-safe TTL + LRU cache.
+
+Entries expire max_age_seconds after they were stored and the least recently
+used entry is evicted once max_entries is reached.  Used for per-process
+caches of hot, cheap-to-rebuild data (user principals, payloads, ...) that
+are invalidated explicitly by the endpoints that change the underlying rows.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after max_age_seconds"""
+
+    def __init__(self, max_entries: int = 1024, max_age_seconds: float = 60.0):
+        self._max_entries = max_entries
+        self._max_age = max_age_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] >= self._max_age:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "max_age_seconds": self._max_age,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
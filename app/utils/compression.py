@@ -0,0 +1,67 @@
+"""
+Response compression middleware.
+
+Uses Brotli when the optional brotli-asgi package is installed and the client
+accepts "br", otherwise gzip.  Streamed responses (NDJSON exam sections) are
+gzip-compressed with a sync flush after every chunk, so each section reaches
+the client as soon as it is sent instead of waiting in the compressor's
+buffer until the whole body is done.
+"""
+import zlib
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    from brotli_asgi import BrotliMiddleware
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BrotliMiddleware = None
+    BROTLI_AVAILABLE = False
+
+STREAMING_MEDIA_TYPES = ("application/x-ndjson",)
+
+
+class FlushingGZipResponder(GZipResponder):
+    """GZipResponder that emits every streamed chunk immediately"""
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if more_body:
+            self.gzip_file.write(body)
+            self.gzip_file.flush(zlib.Z_SYNC_FLUSH)
+            body = self.gzip_buffer.getvalue()
+            self.gzip_buffer.seek(0)
+            self.gzip_buffer.truncate()
+            return body
+        return super().apply_compression(body, more_body=False)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli = None
+        if BROTLI_AVAILABLE:
+            self.brotli = BrotliMiddleware(app, quality=brotli_quality, minimum_size=minimum_size, gzip_fallback=False)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        accept_encoding = headers.get("Accept-Encoding", "")
+        if self.brotli is not None and "br" in accept_encoding and not self._wants_stream(scope, headers):
+            await self.brotli(scope, receive, send)
+        elif "gzip" in accept_encoding:
+            await FlushingGZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    def _wants_stream(scope: Scope, headers: Headers) -> bool:
+        # Brotli's responder buffers; keep streamed sections on the flushing gzip path
+        return b"stream=ndjson" in scope.get("query_string", b"") or \
+            headers.get("Accept", "").startswith(STREAMING_MEDIA_TYPES)
@@ -0,0 +1,25 @@
+"""
+Opaque pagination cursors.
+
+A cursor is a small JSON object (offsets, sort keys, a content ETag, ...)
+encoded as URL-safe base64 so clients treat it as an opaque token and pass it
+back unchanged.  decode_cursor() raises ValueError for anything malformed.
+"""
+import base64
+import json
+
+
+def encode_cursor(state: dict) -> str:
+    raw = json.dumps(state, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(state, dict):
+        raise ValueError("Invalid cursor")
+    return state
@@ -0,0 +1,134 @@
+"""
+Streaming CSV / Parquet / Arrow exports.
+
+The export endpoints read rows in fixed-size partitions from a server-side
+cursor and hand them to one of the writers below, which yield encoded bytes
+as they go - memory use depends on the partition size, not on how many rows
+the export has.
+
+CSV is always available.  Parquet and Arrow IPC need the optional pyarrow
+package; each partition becomes one Parquet row group / one Arrow record
+batch.  The Parquet footer is only written after the last row group, so a
+Parquet download is complete only once the stream ends.
+"""
+import csv
+import io
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    pq = None
+    PYARROW_AVAILABLE = False
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+EXPORT_EXTENSIONS = {"csv": "csv", "parquet": "parquet", "arrow": "arrows"}
+
+
+def export_available(export_format: str) -> bool:
+    return export_format == "csv" or (export_format in EXPORT_MEDIA_TYPES and PYARROW_AVAILABLE)
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(columns: Sequence[str], partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """Header line, then one chunk of CSV per partition of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in partitions:
+        writer.writerows([[_csv_value(value) for value in row] for row in rows])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _record_batch(schema, rows: List[Sequence]):
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(list(values), type=field.type) for values, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+class _Sink(io.RawIOBase):
+    """Write target that lets the caller take what has been written so far"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_parquet(schema, partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """One Parquet row group per partition; `schema` is a pyarrow.Schema"""
+    sink = _Sink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for rows in partitions:
+            if rows:
+                writer.write_batch(_record_batch(schema, rows))
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def iter_arrow(schema, partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """Arrow IPC stream, one record batch per partition"""
+    sink = _Sink()
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for rows in partitions:
+            if rows:
+                writer.write_batch(_record_batch(schema, rows))
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def iter_export(export_format: str, columns: Sequence[str], arrow_types: Sequence[str],
+                partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """
+    Encode partitions of row tuples as export_format.  arrow_types names the
+    pyarrow type factory for each column ("int64", "float64", "string",
+    "bool_", "timestamp_us") and is only used for Parquet / Arrow.
+    """
+    if export_format == "csv":
+        return iter_csv(columns, partitions)
+    schema = pa.schema([
+        (name, pa.timestamp("us") if type_name == "timestamp_us" else getattr(pa, type_name)())
+        for name, type_name in zip(columns, arrow_types)
+    ])
+    if export_format == "parquet":
+        return iter_parquet(schema, partitions)
+    return iter_arrow(schema, partitions)
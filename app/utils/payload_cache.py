@@ -0,0 +1,161 @@
+"""
+Serialized-payload cache for exam / quiz fetch endpoints.
+
+Released exams are read far more often than they change, so the JSON body of
+e.g. GET /exams/{exam_id} is built once and kept as bytes together with a
+strong ETag (a hash of those bytes) and the small bit of exam metadata the
+endpoints need for their access checks (source, discipline, released flag).
+A hit then costs a dict lookup: no database round trip and no serialization,
+and a client that sends the ETag back in If-None-Match gets a 304.
+
+Entries are keyed by (view, exam_id) - each endpoint shapes the payload
+differently - and carry the exam's content version.  invalidate() bumps the
+version, so a payload built from rows read before a write is never stored.
+A max age bounds staleness for writes made by other worker processes.
+
+The body is assembled from individually serialized questions, and the byte
+span of each question is kept, so a page of questions (or an NDJSON stream
+of them) is sliced straight out of the cached bytes without re-serializing.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from app.utils.responses import dumps
+
+
+@dataclass(frozen=True)
+class CachedPayload:
+    body: bytes
+    etag: str
+    metadata: Dict[str, Any]
+    version: Tuple[int, int]
+    # Payload without its questions, and the (start, end) byte span of each question in body
+    head: bytes = b"{}"
+    question_spans: Tuple[Tuple[int, int], ...] = ()
+
+    @property
+    def question_count(self) -> int:
+        return len(self.question_spans)
+
+    def questions_slice(self, offset: int, limit: Optional[int] = None) -> bytes:
+        """Comma-joined JSON of questions[offset:offset + limit], cut from body"""
+        spans = self.question_spans[offset:] if limit is None else self.question_spans[offset:offset + limit]
+        if not spans:
+            return b""
+        return self.body[spans[0][0]:spans[-1][1]]
+
+    def page_body(self, offset: int, limit: int, extra: Dict[str, Any]) -> bytes:
+        """The payload with only one page of questions, plus extra top-level fields"""
+        return (
+            self.head[:-1] + (b"," if len(self.head) > 2 else b"")
+            + b'"questions":[' + self.questions_slice(offset, limit) + b"]"
+            + (b"," + dumps(extra)[1:] if extra else b"}")
+        )
+
+    def iter_ndjson(self, offset: int = 0) -> Iterator[bytes]:
+        """Head line (with question_count), then one line per question"""
+        head = dumps({"question_count": self.question_count, "offset": offset})
+        yield self.head[:-1] + (b"," if len(self.head) > 2 else b"") + head[1:] + b"\n"
+        for start, end in self.question_spans[offset:]:
+            yield self.body[start:end] + b"\n"
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value covers etag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison is what If-None-Match specifies
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _serialize_with_spans(payload: Any):
+    """Serialize payload, recording where each entry of payload["questions"] sits in the bytes"""
+    if not isinstance(payload, dict) or not isinstance(payload.get("questions"), list):
+        body = dumps(payload)
+        return body, body, ()
+    head = dumps({key: value for key, value in payload.items() if key != "questions"})
+    parts = [dumps(question) for question in payload["questions"]]
+
+    # Same bytes as dumps(payload) when "questions" is the last key, as it is for every exam view
+    prefix = head[:-1] + (b"," if len(head) > 2 else b"") + b'"questions":['
+    spans = []
+    position = len(prefix)
+    for part in parts:
+        spans.append((position, position + len(part)))
+        position += len(part) + 1
+    body = prefix + b",".join(parts) + b"]}"
+    return body, head, tuple(spans)
+
+
+class ExamPayloadCache:
+    """Thread-safe (view, exam_id) -> CachedPayload map with per-exam versions"""
+
+    def __init__(self, max_entries: int = 2048, max_age_seconds: float = 300.0):
+        self._max_entries = max_entries
+        self._max_age = max_age_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, CachedPayload]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._global_version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, exam_id: str) -> Tuple[int, int]:
+        """Current content version; read it before loading the rows a payload is built from"""
+        with self._lock:
+            return (self._global_version, self._versions.get(exam_id, 0))
+
+    def get(self, view: str, exam_id: str) -> Optional[CachedPayload]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((view, exam_id))
+            if entry is None or now - entry[0] >= self._max_age:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((view, exam_id))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, view: str, exam_id: str, version: Tuple[int, int],
+            payload: Any, metadata: Dict[str, Any]) -> CachedPayload:
+        """Serialize payload and cache it unless the exam changed since `version` was read"""
+        body, head, spans = _serialize_with_spans(payload)
+        cached = CachedPayload(body=body, etag=make_etag(body), metadata=dict(metadata), version=version,
+                               head=head, question_spans=spans)
+        with self._lock:
+            if (self._global_version, self._versions.get(exam_id, 0)) == version:
+                self._entries[(view, exam_id)] = (time.monotonic(), cached)
+                self._entries.move_to_end((view, exam_id))
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, exam_id: Optional[str] = None):
+        """Drop every view of one exam (or everything when exam_id is None)"""
+        with self._lock:
+            if exam_id is None:
+                self._global_version += 1
+                self._entries.clear()
+                return
+            self._versions[exam_id] = self._versions.get(exam_id, 0) + 1
+            for key in [key for key in self._entries if key[1] == exam_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "max_age_seconds": self._max_age,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
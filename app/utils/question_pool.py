@@ -0,0 +1,82 @@
+"""
+In-process index of quiz question IDs, grouped by discipline and topic.
+
+Smart Quiz generation only needs to know which question IDs exist for each
+topic of a discipline in order to pick ~15 of them.  Loading every Question
+row on every request makes that endpoint cost O(bank size), so this index
+keeps a compact  discipline -> topic -> tuple(question_id)  map in memory and
+only the chosen rows are hydrated from the database.
+
+The index is filled lazily per discipline through a loader callable and is
+invalidated explicitly by the endpoints that write quiz questions.  A max age
+is kept as a safety net for writes made by other worker processes.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class QuestionPoolIndex:
+    """Thread-safe, invalidation-aware discipline -> topic -> question ID index"""
+
+    def __init__(self, loader: Callable[[str], Iterable[Tuple[str, str]]], max_age_seconds: float = 300.0):
+        # loader(discipline) must return (question_id, topic) pairs
+        self._loader = loader
+        self._max_age = max_age_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, Dict[str, Tuple[str, ...]]]] = {}
+        # Bumped on every invalidation so a load that raced with a write is not cached
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def topics(self, discipline: str) -> Dict[str, Tuple[str, ...]]:
+        """Return {topic: (question_id, ...)} for a discipline, loading it if needed"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(discipline)
+            if entry and now - entry[0] < self._max_age:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = (self._global_generation, self._generations.get(discipline, 0))
+
+        grouped: Dict[str, List[str]] = {}
+        for question_id, topic in self._loader(discipline):
+            grouped.setdefault(topic, []).append(question_id)
+        by_topic = {topic: tuple(ids) for topic, ids in grouped.items()}
+
+        with self._lock:
+            if (self._global_generation, self._generations.get(discipline, 0)) == generation:
+                self._entries[discipline] = (time.monotonic(), by_topic)
+        return by_topic
+
+    def size(self, discipline: str) -> int:
+        return sum(len(ids) for ids in self.topics(discipline).values())
+
+    def invalidate(self, discipline: Optional[str] = None):
+        """Drop one discipline (or everything when discipline is None)"""
+        with self._lock:
+            if discipline is None:
+                self._global_generation += 1
+                self._entries.clear()
+            else:
+                self._generations[discipline] = self._generations.get(discipline, 0) + 1
+                self._entries.pop(discipline, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "disciplines": {
+                    discipline: {
+                        "topics": len(by_topic),
+                        "questions": sum(len(ids) for ids in by_topic.values()),
+                        "age_seconds": round(time.monotonic() - loaded_at, 1),
+                    }
+                    for discipline, (loaded_at, by_topic) in self._entries.items()
+                },
+                "hits": self.hits,
+                "misses": self.misses,
+                "max_age_seconds": self._max_age,
+            }
@@ -0,0 +1,118 @@
+"""
+Gap-weighted question sampler used by Smart Quiz generation.
+
+The pool is given already partitioned by topic ({topic: [question, ...]}),
+so each tier (critical / moderate / priority / filler) only touches the
+buckets of its own topics.  Sampling walks a lazily-built random permutation
+(sparse Fisher-Yates) over those buckets and skips anything already picked,
+tracked in a hashed set.  A tier therefore costs O(k + already_selected)
+random draws instead of O(bank size) list scans.
+
+Pass a seed (or a random.Random) to make a selection reproducible.
+"""
+import random
+from bisect import bisect_right
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Sequence, Set, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+# Share of the quiz drawn from each gap tier; priority topics take what is left
+CRITICAL_SHARE = 0.6
+MODERATE_SHARE = 0.3
+
+
+def _unique(topics: Iterable[str]) -> List[str]:
+    seen = set()
+    ordered = []
+    for topic in topics or []:
+        if topic not in seen:
+            seen.add(topic)
+            ordered.append(topic)
+    return ordered
+
+
+def sample_questions(
+    buckets: Sequence[Sequence[T]],
+    k: int,
+    exclude: Optional[Set[T]] = None,
+    rng: Optional[random.Random] = None,
+) -> List[T]:
+    """Pick up to k distinct items across buckets, uniformly, skipping `exclude`"""
+    rng = rng or random.Random()
+    exclude = exclude or set()
+    buckets = [bucket for bucket in buckets if bucket]
+    if k <= 0 or not buckets:
+        return []
+
+    offsets = []
+    total = 0
+    for bucket in buckets:
+        offsets.append(total)
+        total += len(bucket)
+
+    picked: List[T] = []
+    picked_set: Set[T] = set()
+    swaps: Dict[int, int] = {}
+    for i in range(total):
+        # Sparse Fisher-Yates: position i of a random permutation of range(total)
+        j = rng.randrange(i, total)
+        position = swaps.get(j, j)
+        swaps[j] = swaps.get(i, i)
+
+        b = bisect_right(offsets, position) - 1
+        item = buckets[b][position - offsets[b]]
+        if item in exclude or item in picked_set:
+            continue
+        picked.append(item)
+        picked_set.add(item)
+        if len(picked) == k:
+            break
+    return picked
+
+
+def select_by_gap_profile(
+    gap_profile: Mapping[str, List[str]],
+    pool_by_topic: Mapping[str, Sequence[T]],
+    total_count: int,
+    seed: Optional[int] = None,
+    rng: Optional[random.Random] = None,
+) -> List[T]:
+    """
+    Select total_count questions weighted towards the user's weak topics:
+    60% critical gaps, 30% moderate gaps, the rest priority topics, and any
+    shortfall filled from topics outside the user's strong areas.
+    """
+    rng = rng or random.Random(seed)
+    selected: List[T] = []
+    selected_set: Set[T] = set()
+
+    def take(topics: Iterable[str], k: int) -> List[T]:
+        buckets = [pool_by_topic[topic] for topic in _unique(topics) if topic in pool_by_topic]
+        chosen = sample_questions(buckets, k, selected_set, rng)
+        selected.extend(chosen)
+        selected_set.update(chosen)
+        return chosen
+
+    take(gap_profile.get("critical_gaps", []), int(total_count * CRITICAL_SHARE))
+    take(gap_profile.get("moderate_gaps", []), int(total_count * MODERATE_SHARE))
+    take(gap_profile.get("priority_topics", []), total_count - len(selected))
+
+    remaining = total_count - len(selected)
+    if remaining > 0:
+        strong = set(gap_profile.get("strong_areas", []))
+        # Sorted so a seeded selection does not depend on dict insertion order
+        non_strong = [topic for topic in sorted(pool_by_topic) if topic not in strong]
+        if not take(non_strong, remaining):
+            # Only strong-area questions left - better than a short quiz
+            take(sorted(pool_by_topic), remaining)
+
+    rng.shuffle(selected)
+    return selected
+
+
+def partition_by_topic(questions: Iterable[T], topic_of=lambda q: q.topic) -> Dict[str, List[T]]:
+    """Group a flat question list into {topic: [question, ...]} in one pass"""
+    by_topic: Dict[str, List[T]] = {}
+    for question in questions:
+        by_topic.setdefault(topic_of(question) or "unknown", []).append(question)
+    return by_topic
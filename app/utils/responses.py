@@ -0,0 +1,38 @@
+"""
+Fast JSON rendering for API responses.
+
+FastJSONResponse is the app's default response class.  It renders with orjson
+when it is installed (several times faster than the stdlib encoder on large
+exam payloads) and falls back to Starlette's JSONResponse otherwise.
+dumps() is the same encoder for code that caches pre-serialized bodies.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# Handlers return plain dicts, some with int keys (e.g. answers keyed by index)
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if ORJSON_AVAILABLE else 0
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=str, option=_ORJSON_OPTIONS)
+    return json.dumps(content, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered through orjson when available"""
+
+    def render(self, content: Any) -> bytes:
+        if ORJSON_AVAILABLE:
+            return orjson.dumps(content, option=_ORJSON_OPTIONS)
+        return super().render(content)
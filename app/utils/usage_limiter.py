@@ -0,0 +1,189 @@
+"""
+In-memory tier for the daily AI usage limits.
+
+Limit checks sit in front of every simulation / procedure / AI quiz call, so
+they are served from a per-process map of today's counters instead of a
+database transaction.  A counter is seeded from daily_usage_tracking the first
+time a (user, day, resource) is touched; reservations then only take a lock
+and compare two integers.
+
+Increments and rate-limit decisions are written behind: a background thread
+hands the accumulated per-counter deltas and the pending decision rows to a
+flush callback every flush_interval_seconds, and once more at shutdown.  If
+the callback raises, the deltas are put back and retried on the next flush.
+Denials are always recorded; allowed decisions are sampled.
+
+Counters are per process.  With several workers each one only sees the
+others' usage after it re-seeds a counter (max_age_seconds after seeding, and
+only once its own deltas are flushed), so a user can briefly overshoot a limit
+by what other workers admitted in that window.  That's why the
+database-backed limiter (USAGE_LIMITER_BACKEND=database) is the default;
+this tier is opt-in.
+"""
+import random
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (user_id, tracking_date, resource_type)
+CounterKey = Tuple[int, date, str]
+
+
+class UsageCounterStore:
+    """Thread-safe daily usage counters with write-behind persistence"""
+
+    def __init__(self, flush_interval_seconds: float = 5.0, max_age_seconds: float = 60.0,
+                 decision_sample_rate: float = 0.1, max_pending_decisions: int = 10000):
+        self._flush_interval = flush_interval_seconds
+        self._max_age = max_age_seconds
+        self._sample_rate = decision_sample_rate
+        self._max_pending_decisions = max_pending_decisions
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # key -> [count, seeded_at]
+        self._counts: Dict[CounterKey, list] = {}
+        # key -> [unflushed delta, is_premium]
+        self._pending: Dict[CounterKey, list] = {}
+        self._decisions: List[dict] = []
+        # Keys whose deltas are being written right now; not re-seeded until that commits
+        self._in_flight: Dict[CounterKey, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.flush_errors = 0
+        self.dropped_decisions = 0
+
+    def _current(self, key: CounterKey, load_count: Callable[[], int]) -> list:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is not None and not self._is_stale(key, entry, now):
+                return entry
+        # Seed outside the lock - load_count reads the database
+        persisted = load_count() or 0
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None or self._is_stale(key, entry, now):
+                entry = [persisted, now]
+                self._counts[key] = entry
+            return entry
+
+    def _is_stale(self, key: CounterKey, entry: list, now: float) -> bool:
+        # Caller holds the lock
+        return now - entry[1] >= self._max_age and key not in self._pending and key not in self._in_flight
+
+    def reserve(self, key: CounterKey, amount: int, limit: Optional[int],
+                load_count: Callable[[], int], is_premium: bool = False) -> Tuple[bool, int]:
+        """
+        Add amount to the counter if the result stays within limit (None = no limit).
+        Returns (allowed, count after the call).  amount=0 just reads the counter.
+        """
+        entry = self._current(key, load_count)
+        with self._lock:
+            if limit is not None and amount > 0 and entry[0] + amount > limit:
+                return False, entry[0]
+            if amount:
+                entry[0] += amount
+                pending = self._pending.setdefault(key, [0, is_premium])
+                pending[0] += amount
+                pending[1] = is_premium
+            return True, entry[0]
+
+    def reset(self, user_id: int, tracking_date: date, reset_persisted: Optional[Callable[[], None]] = None):
+        """
+        Forget a user's counters for a day, including unflushed deltas.
+        reset_persisted (e.g. zeroing the daily_usage_tracking row) runs while
+        no flush can happen, so nothing written before the reset lands after it.
+        """
+        def drop(maps):
+            with self._lock:
+                for counters in maps:
+                    for key in [key for key in counters if key[0] == user_id and key[1] == tracking_date]:
+                        del counters[key]
+
+        with self._flush_lock:
+            drop((self._counts, self._pending))
+            if reset_persisted is not None:
+                reset_persisted()
+                # A reservation made meanwhile seeded from the old row; make it re-seed
+                drop((self._counts,))
+
+    def record_decision(self, row: dict):
+        """Queue a rate_limit_decisions row; allowed decisions are sampled"""
+        if row.get("allowed") and random.random() >= self._sample_rate:
+            return
+        with self._lock:
+            if len(self._decisions) >= self._max_pending_decisions:
+                self.dropped_decisions += 1
+                return
+            self._decisions.append(row)
+
+    def flush(self, write: Callable[[Dict[CounterKey, Tuple[int, bool]], List[dict]], None]) -> int:
+        """Hand pending deltas and decisions to write(); returns the number of counters flushed"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                decisions, self._decisions = self._decisions, []
+                self._in_flight = {key: value[0] for key, value in pending.items()}
+                # Yesterday's counters are only needed until their deltas are written
+                today = date.today()
+                for key in [key for key in self._counts if key[1] < today and key not in pending]:
+                    del self._counts[key]
+            if not pending and not decisions:
+                return 0
+            try:
+                write({key: (delta, is_premium) for key, (delta, is_premium) in pending.items()}, decisions)
+            except Exception:
+                self.flush_errors += 1
+                with self._lock:
+                    for key, (delta, is_premium) in pending.items():
+                        merged = self._pending.setdefault(key, [0, is_premium])
+                        merged[0] += delta
+                    room = self._max_pending_decisions - len(self._decisions)
+                    self.dropped_decisions += max(0, len(decisions) - room)
+                    self._decisions[:0] = decisions[:max(0, room)]
+                    self._in_flight = {}
+                raise
+            with self._lock:
+                self._in_flight = {}
+            self.flushes += 1
+            return len(pending)
+
+    def start(self, write: Callable[[Dict[CounterKey, Tuple[int, bool]], List[dict]], None]):
+        """Flush in a daemon thread every flush_interval_seconds until stop()"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self._flush_interval):
+                try:
+                    self.flush(write)
+                except Exception as e:
+                    print(f"⚠️ Usage counter flush failed, will retry: {e}")
+
+        self._thread = threading.Thread(target=run, name="usage-counter-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self, write: Callable[[Dict[CounterKey, Tuple[int, bool]], List[dict]], None]):
+        """Stop the flush thread and write whatever is still pending"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._flush_interval + 5)
+            self._thread = None
+        self.flush(write)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "counters": len(self._counts),
+                "pending_counters": len(self._pending),
+                "pending_decisions": len(self._decisions),
+                "flush_interval_seconds": self._flush_interval,
+                "max_age_seconds": self._max_age,
+                "decision_sample_rate": self._sample_rate,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "dropped_decisions": self.dropped_decisions,
+            }
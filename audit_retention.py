@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+AUDIT RETENTION
+Rollups and expiry for rate_limit_decisions / user_activity.
+
+Uses DATABASE_URL like the app (defaults to ./theclamed.db).
+
+    python audit_retention.py rollup --since 2025-01-01      # backfill daily rollups
+    python audit_retention.py purge --dry-run                 # what would be expired
+    python audit_retention.py purge                           # roll up, then expire past the TTLs
+    python audit_retention.py partition                       # PostgreSQL: partition rate_limit_decisions by month
+    python audit_retention.py maintain                        # all of the above that applies (daily cron)
+
+TTLs come from RATE_DECISION_RETENTION_DAYS (90) and USER_ACTIVITY_RETENTION_DAYS
+(365); 0 keeps rows forever.  exam_completed activity is never expired.
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app.database import engine
+from app.utils import audit_retention as retention
+
+
+def parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def cmd_rollup(args):
+    retention.ensure_rollup_table(engine)
+    until = args.until or date.today() - timedelta(days=1)
+    with engine.begin() as conn:
+        since = args.since
+        if since is None:
+            oldest = conn.execute(select(func.min(retention.decisions_table.c.decision_time))).scalar()
+            if oldest is None:
+                print("📭 No rate limit decisions to roll up")
+                return
+            since = (datetime.fromisoformat(oldest) if isinstance(oldest, str) else oldest).date()
+        print(f"📊 Rolling up rate limit decisions {since} → {until} ...")
+        rows = retention.rollup_rate_decisions(conn, since, until)
+    print(f"✅ {rows} rollup rows written")
+
+
+def cmd_purge(args):
+    today = date.today()
+    decision_days = retention.RATE_DECISION_RETENTION_DAYS
+    activity_days = retention.USER_ACTIVITY_RETENTION_DAYS
+
+    if args.dry_run:
+        with engine.connect() as conn:
+            if decision_days > 0:
+                cutoff = datetime.combine(today - timedelta(days=decision_days), datetime.min.time())
+                count = conn.execute(select(func.count()).select_from(retention.decisions_table).where(
+                    retention.decisions_table.c.decision_time < cutoff)).scalar()
+                print(f"🔍 rate_limit_decisions older than {cutoff.date()}: {count} rows")
+            if activity_days > 0:
+                cutoff = datetime.combine(today - timedelta(days=activity_days), datetime.min.time())
+                count = conn.execute(select(func.count()).select_from(retention.activity_table).where(
+                    retention.activity_table.c.timestamp < cutoff,
+                    retention.activity_table.c.activity_type.notin_(retention.RETAINED_ACTIVITY_TYPES))).scalar()
+                print(f"🔍 user_activity older than {cutoff.date()} (excluding exam results): {count} rows")
+        return
+
+    retention.ensure_rollup_table(engine)
+    if decision_days > 0:
+        report = retention.purge_rate_decisions(engine, today - timedelta(days=decision_days))
+        print(f"🧹 rate_limit_decisions: {report}")
+    if activity_days > 0:
+        deleted = retention.purge_user_activity(engine, today - timedelta(days=activity_days))
+        print(f"🧹 user_activity: {deleted} rows deleted")
+
+
+def cmd_partition(args):
+    if engine.dialect.name != "postgresql":
+        print("❌ Partitioning needs PostgreSQL - SQLite databases rely on rollups + row expiry")
+        return
+    if retention.partition_rate_decisions(engine):
+        print("✅ rate_limit_decisions is now partitioned by month on decision_time")
+    else:
+        print("ℹ️ rate_limit_decisions is already partitioned")
+
+
+def cmd_maintain(args):
+    report = retention.run_maintenance(engine)
+    print(f"✅ Maintenance done: {report}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rollup = commands.add_parser("rollup", help="Backfill daily rollups from the raw decisions")
+    rollup.add_argument("--since", type=parse_day, help="First day (default: oldest decision)")
+    rollup.add_argument("--until", type=parse_day, help="Last day (default: yesterday - today is still filling up)")
+    rollup.set_defaults(func=cmd_rollup)
+
+    purge = commands.add_parser("purge", help="Expire rows past their TTL")
+    purge.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    purge.set_defaults(func=cmd_purge)
+
+    partition = commands.add_parser("partition", help="PostgreSQL: partition rate_limit_decisions by month")
+    partition.set_defaults(func=cmd_partition)
+
+    maintain = commands.add_parser("maintain", help="Rollups, partitions and expiry in one pass")
+    maintain.set_defaults(func=cmd_maintain)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+EXAM RESULTS BACKFILL
+Copies exam_completed rows from user_activity into the exam_results table.
+
+The app does this once on its first start after the table was added
+(EXAM_RESULTS_AUTO_BACKFILL, default on).  Run this to do it ahead of a
+deploy, or to pick up submissions written by workers still on the old code.
+Safe to re-run: activities already copied are skipped.
+
+    python backfill_exam_results.py
+    python backfill_exam_results.py --batch-size 5000
+"""
+import argparse
+import os
+
+# The app's own startup backfill would race this run
+os.environ["EXAM_RESULTS_AUTO_BACKFILL"] = "false"
+
+import main
+
+
+def run_backfill(batch_size):
+    print("🔄 Backfilling exam results from user_activity...")
+    db = main.SessionLocal()
+    try:
+        copied = main.backfill_exam_results(db, batch_size=batch_size)
+        total = db.query(main.ExamResult).count()
+    finally:
+        db.close()
+    print(f"✅ Copied {copied} results ({total} rows in exam_results)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    run_backfill(parser.parse_args().batch_size)
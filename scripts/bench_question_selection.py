@@ -0,0 +1,109 @@
+"""
+Micro-benchmark for the Smart Quiz question sampler.
+
+Builds synthetic question-ID pools of 10k / 100k / 1M questions spread over
+a set of topics and times select_by_gap_profile() against them.  The old
+list-scanning selector is timed as well for the smaller pools.
+
+Run from the repository root:
+    python scripts/bench_question_selection.py
+    python scripts/bench_question_selection.py --sizes 10000 100000 --repeat 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.question_selection import select_by_gap_profile  # noqa: E402
+
+TOPICS = [
+    "pharmacology", "anatomy", "physiology", "clinical_skills", "patient_care",
+    "medical_ethics", "emergency_care", "diagnosis", "microbiology", "pathology",
+]
+
+GAP_PROFILE = {
+    "critical_gaps": ["pharmacology", "clinical_skills"],
+    "moderate_gaps": ["anatomy", "physiology"],
+    "strong_areas": ["patient_care", "medical_ethics"],
+    "priority_topics": ["pharmacology", "clinical_skills"],
+}
+
+LegacyQuestion = namedtuple("LegacyQuestion", "id topic")
+
+
+def build_pool(size, rng):
+    pool = {topic: [] for topic in TOPICS}
+    for i in range(size):
+        pool[rng.choice(TOPICS)].append(f"quiz_{i:08d}_q1")
+    return {topic: tuple(ids) for topic, ids in pool.items()}
+
+
+def legacy_select(gap_profile, all_questions, total_count):
+    """The previous O(n*k) selector, without its logging"""
+    selected = []
+    critical = [q for q in all_questions if q.topic in gap_profile["critical_gaps"]]
+    if critical:
+        selected.extend(random.sample(critical, min(int(total_count * 0.6), len(critical))))
+    remaining = [q for q in all_questions if q not in selected]
+    moderate = [q for q in remaining if q.topic in gap_profile["moderate_gaps"]]
+    if moderate:
+        selected.extend(random.sample(moderate, min(int(total_count * 0.3), len(moderate))))
+    priority_count = total_count - len(selected)
+    remaining = [q for q in all_questions if q not in selected]
+    priority = [q for q in remaining if q.topic in gap_profile["priority_topics"]]
+    if priority and priority_count > 0:
+        selected.extend(random.sample(priority, min(priority_count, len(priority))))
+    remaining_count = total_count - len(selected)
+    if remaining_count > 0:
+        remaining = [q for q in all_questions if q not in selected]
+        non_strong = [q for q in remaining if q.topic not in gap_profile["strong_areas"]]
+        if non_strong:
+            selected.extend(random.sample(non_strong, min(remaining_count, len(non_strong))))
+    random.shuffle(selected)
+    return selected
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--count", type=int, default=15, help="questions per quiz")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="largest pool to run the legacy selector on")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'pool size':>10}  {'new (ms)':>10}  {'legacy (ms)':>12}  speedup")
+    for size in args.sizes:
+        pool = build_pool(size, rng)
+        new_time = timed(lambda: select_by_gap_profile(GAP_PROFILE, pool, args.count), args.repeat)
+
+        legacy_time = None
+        if size <= args.legacy_max:
+            flat = [LegacyQuestion(qid, topic) for topic, ids in pool.items() for qid in ids]
+            legacy_time = timed(lambda: legacy_select(GAP_PROFILE, flat, args.count), max(1, args.repeat // 20))
+
+        legacy_col = f"{legacy_time * 1000:12.3f}" if legacy_time is not None else f"{'-':>12}"
+        speedup = f"{legacy_time / new_time:7.0f}x" if legacy_time is not None else ""
+        print(f"{size:>10}  {new_time * 1000:10.3f}  {legacy_col}  {speedup}")
+
+    # Same seed, same pool -> same quiz
+    pool = build_pool(args.sizes[0], random.Random(7))
+    first = select_by_gap_profile(GAP_PROFILE, pool, args.count, seed=1234)
+    again = select_by_gap_profile(GAP_PROFILE, pool, args.count, seed=1234)
+    print(f"\nseeded selection reproducible: {first == again}")
+
+
+if __name__ == "__main__":
+    main()
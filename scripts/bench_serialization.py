@@ -0,0 +1,111 @@
+"""
+Serialization benchmark for a 200-question USMLE exam payload.
+
+Compares the ways GET /exams/usmle/{exam_id} can turn its payload into bytes:
+
+  legacy          jsonable_encoder + stdlib json (the old default path)
+  response_model  pydantic-core validate/serialize of UsmleExamDetail + FastJSONResponse
+  orjson          FastJSONResponse on the plain dict (no model)
+  payload cache   building a cache entry (serialize + ETag); hits reuse the bytes
+
+main is imported from a temporary working directory so its startup code
+creates throwaway SQLite files instead of touching the real databases.
+
+Run from the repository root:
+    python scripts/bench_serialization.py
+    python scripts/bench_serialization.py --questions 500 --repeat 500
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def build_payload(question_count, rng):
+    topics = ["cardiology", "nephrology", "pharmacology", "microbiology", "biostatistics"]
+    return {
+        "id": "usmle_step1_bench",
+        "title": "USMLE Step 1 - Benchmark Block",
+        "discipline_id": "usmle",
+        "time_limit": 280,
+        "source": "usmle",
+        "step": "1",
+        "questions": [
+            {
+                "text": f"A {rng.randint(18, 80)}-year-old patient presents with ... (vignette {i}) " * 6,
+                "options": [f"Option {chr(65 + j)}: " + "plausible distractor text " * 3 for j in range(5)],
+                "correct_idx": rng.randint(0, 4),
+                "rationale": "Explanation of the correct answer and why each distractor is wrong. " * 8,
+                "topic": rng.choice(topics),
+                "difficulty": "advanced",
+            }
+            for i in range(question_count)
+        ],
+    }
+
+
+def timed(fn, repeat):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_serialization_")
+    os.chdir(workdir)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+
+    import main as api
+    from app.utils.payload_cache import ExamPayloadCache
+    from app.utils.responses import ORJSON_AVAILABLE, FastJSONResponse
+
+    payload = build_payload(args.questions, random.Random(42))
+    adapter = TypeAdapter(api.UsmleExamDetail)
+    cache = ExamPayloadCache()
+
+    def legacy():
+        return JSONResponse(jsonable_encoder(payload)).body
+
+    def response_model():
+        # What FastAPI does for a declared response_model, minus routing
+        return FastJSONResponse(adapter.dump_python(adapter.validate_python(payload), mode="json")).body
+
+    def plain_orjson():
+        return FastJSONResponse(payload).body
+
+    def cache_fill():
+        return cache.put("usmle", payload["id"], cache.version(payload["id"]), payload, {}).body
+
+    size_kb = len(legacy()) / 1024
+    print(f"📦 {args.questions}-question USMLE payload, {size_kb:.0f} KB, orjson available: {ORJSON_AVAILABLE}")
+
+    baseline = timed(legacy, args.repeat)
+    print(f"{'path':<16} {'ms/response':>12}  speedup")
+    for name, fn in [("legacy", legacy), ("response_model", response_model),
+                     ("orjson", plain_orjson), ("payload cache", cache_fill)]:
+        elapsed = baseline if fn is legacy else timed(fn, args.repeat)
+        print(f"{name:<16} {elapsed * 1000:12.3f}  {baseline / elapsed:6.1f}x")
+
+    same = jsonable_encoder(payload) == json.loads(response_model())
+    print(f"\nresponse_model output matches legacy: {same}")
+
+
+if __name__ == "__main__":
+    main()
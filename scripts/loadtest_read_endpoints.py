@@ -0,0 +1,138 @@
+"""
+Load test for the hot read endpoints (exam / quiz fetches and listings).
+
+Runs N concurrent clients for a fixed duration against a running server and
+reports requests/second and latency percentiles per endpoint.  Use --label
+and --output to save a run, then --compare to diff it against an earlier one
+(e.g. the same commit before and after the async database port).
+
+Run from the repository root against a running server:
+    python scripts/loadtest_read_endpoints.py --email a@b.com --password pw \\
+        --exam-id p1 --note-id s1 --quiz-id quiz_123 --label async --output async.json
+    python scripts/loadtest_read_endpoints.py ... --label sync --compare async.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def login(client, email, password):
+    response = await client.post("/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def worker(client, path, headers, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, headers=headers)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_endpoint(client, path, headers, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker(client, path, headers, deadline, latencies, errors) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def build_paths(args):
+    paths = ["/exams", "/exams/usmle/list"]
+    if args.exam_id:
+        paths.append(f"/exams/{args.exam_id}")
+    if args.note_id:
+        paths.append(f"/exam/{args.note_id}")
+    if args.quiz_id:
+        paths.append(f"/quiz/{args.quiz_id}")
+    return paths + (args.path or [])
+
+
+async def main_async(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        token = args.token or (await login(client, args.email, args.password) if args.email else None)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+        results = {}
+        for path in build_paths(args):
+            # Short warm-up so connection setup is not counted
+            await run_endpoint(client, path, headers, args.concurrency, min(1.0, args.duration))
+            results[path] = await run_endpoint(client, path, headers, args.concurrency, args.duration)
+            stats = results[path]
+            print(f"{path:<40} {stats['rps']:>9.1f} rps  p50 {stats['p50_ms']:>7.2f} ms  "
+                  f"p95 {stats['p95_ms']:>7.2f} ms  errors {stats['errors']}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=os.getenv("API_BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--email", help="approved user to log in as")
+    parser.add_argument("--password")
+    parser.add_argument("--token", help="use an existing bearer token instead of logging in")
+    parser.add_argument("--exam-id", help="released plural exam in the user's discipline")
+    parser.add_argument("--note-id", help="singular exam (study note) in the user's discipline")
+    parser.add_argument("--quiz-id")
+    parser.add_argument("--path", action="append", help="extra GET path to include (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    print(f"🚀 {args.label}: {args.concurrency} clients x {args.duration:.0f}s per endpoint against {args.base_url}")
+    results = asyncio.run(main_async(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"label": args.label, "concurrency": args.concurrency,
+                       "duration": args.duration, "results": results}, f, indent=2)
+        print(f"💾 Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\n{'endpoint':<40} {baseline['label']:>12} {args.label:>12}  change")
+        for path, stats in results.items():
+            before = baseline["results"].get(path)
+            if not before or not before["rps"]:
+                continue
+            change = (stats["rps"] - before["rps"]) / before["rps"] * 100
+            print(f"{path:<40} {before['rps']:>12.1f} {stats['rps']:>12.1f}  {change:+.1f}%")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
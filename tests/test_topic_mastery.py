@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    """Import the app against a throwaway database (the keamed file lands in a temp dir)"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    os.environ.setdefault("AI_ENHANCE_EXPLANATIONS", "false")
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("cwd"))
+    sys.path.insert(0, ROOT)
+    try:
+        import main as app_main
+    finally:
+        os.chdir(cwd)
+    return app_main
+
+
+def test_positional_answers_follow_payload_order(main):
+    db = main.SessionLocal()
+    try:
+        user = main.User(email="mastery@example.com", full_name="Mastery", hashed_password="x")
+        db.add(user)
+        db.add(main.Exam(id="ex", title="Order", discipline_id="nurse", source="quiz"))
+        # Inserted out of order; the payload shows them as q1, q2, q3, q10
+        for question_id, topic in (("q10", "renal"), ("q2", "cardiac"), ("q1", "anatomy"), ("q3", "pharmacology")):
+            db.add(main.Question(id=f"ex_{question_id}", exam_id="ex", text=question_id,
+                                 options=["a", "b", "c", "d"], correct_idx=0, topic=topic))
+        db.commit()
+
+        # Positions 0 and 1 (q1, q2) right, 2 and 3 (q3, q10) wrong
+        main.update_topic_mastery(db, user.id, "ex", [0, 0, 1, 1])
+
+        rows = db.query(main.UserTopicMastery).filter(main.UserTopicMastery.user_id == user.id).all()
+        counts = {row.topic: (row.attempts, row.correct) for row in rows}
+        assert counts == {
+            "anatomy": (1, 1),
+            "cardiac": (1, 1),
+            "pharmacology": (1, 0),
+            "renal": (1, 0),
+        }
+    finally:
+        db.close()